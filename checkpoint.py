@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+class Checkpoint:
+
+    "Periodically save and restore the progress of a long-running simulation"
+
+    def __init__(self, path:str, fingerprint:str, interval:float=60.):
+
+        ''' Set up a checkpoint file for a run identified by fingerprint
+
+        The file holds a header line with the fingerprint and run settings, followed by
+        one line per save, each with the position, the running state and only the genome
+        sets found since the last save. interval is the minimum number of seconds between saves '''
+        self.path = path
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self._last_save = time.monotonic()
+        self._saved_genomes = 0
+        self._started = False
+        self.settings = None    # Run settings stored in the header, such as the chosen strategy
+
+    @staticmethod
+    def make_fingerprint(**inputs):
+
+        ''' Hash the inputs which fully determine a run; inputs must encode deterministically '''
+        encoded = json.dumps(inputs, sort_keys=True)
+
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def load(self):
+
+        ''' Return (position, state, genomes) from a matching checkpoint, or ((0, 0), None, []) '''
+        if not os.path.exists(self.path):
+            return (0, 0), None, []
+
+        with open(self.path) as f:
+            lines = f.readlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = {}
+        if header.get('fingerprint') != self.fingerprint:
+            logger.warning('Checkpoint {} is for a different run - starting from scratch'.format(self.path))
+            return (0, 0), None, []
+        self.settings = header.get('settings')
+
+        # A save interrupted part way through leaves an incomplete final line
+        (position, state, genomes, complete) = ((0, 0), None, [], lines[:1])
+        for line in lines[1:]:
+            try:
+                saved = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith('\n'):
+                break
+            position = tuple(saved['position'])
+            state = saved['state']
+            genomes += [(weight1, weight2, chain) for (weight1, weight2, chain) in saved['genomes']]
+            complete += [line]
+
+        # Continue appending after the last complete save
+        if len(complete) < len(lines):
+            with open(self.path, 'w') as f:
+                f.writelines(complete)
+        self._saved_genomes = len(genomes)
+        self._started = True
+
+        logger.info('Resuming from checkpoint {} at position {}'.format(self.path, position))
+        return position, state, genomes
+
+    def due(self):
+
+        ''' Check whether enough time has passed since the last save '''
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(self, position:tuple, state:dict, genomes:list):
+
+        ''' Append the position, state and genome sets added since the last save '''
+        mode = 'a' if self._started else 'w'
+        with open(self.path, mode) as f:
+            if not self._started:
+                f.write(json.dumps({'fingerprint': self.fingerprint, 'settings': self.settings}) + '\n')
+            f.write(json.dumps({'position': list(position), 'state': state,
+                                'genomes': genomes[self._saved_genomes:]}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._started = True
+        self._saved_genomes = len(genomes)
+        self._last_save = time.monotonic()
+        logger.debug('Checkpoint saved at position {}'.format(position))
+
+    def clear(self):
+
+        ''' Remove the checkpoint file once a run is complete '''
+        if os.path.exists(self.path):
+            os.remove(self.path)
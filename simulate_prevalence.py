@@ -1,25 +1,60 @@
 import pandas as pd
 import logging
+import random
+import sys
+import time
+from itertools import islice
 from weighted_permutations import WeightedPermutations
 from family_tree import FamilyTree
+from checkpoint import Checkpoint
+from simulation_plan import SimulationPlan
 
 logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
+# Limits on the sampling used to estimate simulation costs
+_PLAN_SAMPLES = 200
+_PLAN_TRUNCATED_SAMPLES = 10000
+_PLAN_INITIAL_GENOMES = 5000
+
 
 class SimulatePrevalence:
 
     def __init__(self, family_tree:FamilyTree,
-                 recessives_are_known:bool=True, recessive_prevalence:float=None):
-
-        ''' Set up persistent objects to populate data '''
+                 recessives_are_known:bool=True, recessive_prevalence:float=None,
+                 tolerance:float=None, checkpoint_path:str=None, checkpoint_interval:float=60.,
+                 max_seconds:float=None, max_memory:float=None, max_tolerance:float=None,
+                 plan_only:bool=False):
+
+        ''' Set up persistent objects to populate data
+
+        If tolerance is set, founder genomes are explored in decreasing prior weight and
+        the simulation stops once every probability is within tolerance of its exact value.
+        If checkpoint_path is set, progress is saved every checkpoint_interval seconds and
+        a run of the same pedigree resumes from the last checkpoint.
+        Runs estimated to exceed max_seconds or max_memory (bytes) are refused, or
+        downgraded to a truncated run with a tolerance up to max_tolerance if set.
+        If plan_only is set, the run is planned but not simulated '''
         self._recessives_are_known=recessives_are_known
         self._recessive_prevalence=recessive_prevalence
+        self._tolerance=tolerance
+        self._checkpoint_path=checkpoint_path
+        self._checkpoint_interval=checkpoint_interval
+        self._checkpoint = None
+        self._resume = ((0, 0), None, [])
+        self._max_seconds=max_seconds
+        self._max_memory=max_memory
+        self._max_tolerance=max_tolerance
         self.optimise_tree(family_tree)
 
         # Define simulation object
         self._simulation = None
-        self.simulate(recessive_prevalence)# Set simulation object
+        self._unexplored_weight = 0.
+        self._plan = None
+        if plan_only:
+            self.plan_simulation(recessive_prevalence)
+        else:
+            self.simulate(recessive_prevalence)# Set simulation object
 
     def optimise_tree(self, family_tree:FamilyTree):
 
@@ -43,43 +78,33 @@ class SimulatePrevalence:
         key_people = self.__independent_genomes
         logger.debug('Key people are: {}'.format(', '.join(key_people)))
 
-        # Generate all initial genomes
-        raw_chains = WeightedPermutations.run(len(key_people), 2)
-        logger.info('{} key people; initially {} independent unvalidated initial genomes'.format(
-            len(key_people), len(raw_chains)))
-
-        # Enforce conditions on initial genomes
-        raw_dicts = [(weight1, weight2, dict(zip(key_people, chain)))
-                     for (weight1, weight2, chain) in raw_chains]
-        checked_initial_dicts = self._check_list_of_genomes(raw_dicts)
+        # Generate only valid initial genomes, weighted by the prior population prevalence
+        def weight_prevalence(weight, chain, gene_frequency):
 
-        # Adjust initial genomes by prior distribution of population prevalence
-        def weight_prevalence(transmission, gene_frequency):
-
-            (weight, junk, gene_dict) = transmission
-            chain = list(gene_dict.values())
             weight = weight * (gene_frequency ** sum(chain)) *\
                      ((1-gene_frequency) ** (2 * len(chain) - sum(chain)))
 
-            return (weight, weight, chain)
-
-        weighted_genomes = [weight_prevalence(transmission, gene_frequency)
-                           for transmission in checked_initial_dicts]
+            return (weight, weight, dict(zip(key_people, chain)))
 
-        def convert_to_dicts(weighted_genomes, key_people):
+        weighted_genomes = [weight_prevalence(weight, chain, gene_frequency)
+                            for (weight, junk, chain) in self._founder_permutations()]
+        logger.info('{} key people; {} valid independent initial genomes'.format(
+            len(key_people), len(weighted_genomes)))
 
-            def convert(potential_initial, key_people):
+        return weighted_genomes
 
-                (weight, weight, chain) = potential_initial
+    def _founder_permutations(self):
 
-                return (weight, weight, dict(zip(key_people, chain)))
+        ''' Get the permutations of valid statuses for people with independent genomes '''
+        allowed = [self._allowed_statuses(person) for person in self.__independent_genomes]
 
-            return [convert(x, key_people) for x in weighted_genomes]
+        return WeightedPermutations(len(self.__independent_genomes), 2, allowed)
 
-        logger.info('{} key people; after validation, {} independent initial genomes remain'.format(
-            len(key_people), len(weighted_genomes)))
+    @staticmethod
+    def _allele_weights(gene_frequency):
 
-        return convert_to_dicts(weighted_genomes, key_people)
+        ''' Prior weight of each allele pairing, excluding the binomial ordering factor '''
+        return [(1-gene_frequency) ** 2, gene_frequency * (1-gene_frequency), gene_frequency ** 2]
 
     def _get_transmission_chains(self, relationships=None):
 
@@ -93,23 +118,12 @@ class SimulatePrevalence:
 
         return transmissions
 
-    def _check_list_of_genomes(self, genomes):
+    def _allowed_statuses(self, person, statuses=(0, 1, 2)):
 
-        temp = [self._check_genome(genome) for genome in genomes]
-
-        return [x for x in temp if x is not None]
-
-    def _check_genome(self, genome):
-
-        (prior_wgt, new_wgt, genome_dict) = genome
-
-        for person in genome_dict.keys():
-            if not self._check_status_is_valid(genome_dict[person], person):
-                return None
-            if not self._check_recessive_list(genome_dict[person], person):
-                return None
-
-        return genome
+        ''' Get the statuses a person can take given known statuses and recessives '''
+        return [status for status in statuses
+                if self._check_status_is_valid(status, person)
+                and self._check_recessive_list(status, person)]
 
     def _check_status_is_valid(self, status, child):
 
@@ -145,21 +159,102 @@ class SimulatePrevalence:
 
         Iterate through pairs of initial conditions and transmission chains '''
 
-        genomes = []
+        ((start_seed, start_chain), state, genomes) = self._load_checkpoint()
         logger.info('Starting simulation - {} potential genome sets to create'.format(
             len(initial_genomes) * len(transmission_chains)))
-        for (orig_swgt, seed_wgt, seed_status) in initial_genomes:
-            for (orig_cwgt, chain_wgt, chain) in transmission_chains:
+        for seed_pos in range(start_seed, len(initial_genomes)):
+            (orig_swgt, seed_wgt, seed_status) = initial_genomes[seed_pos]
+            first_chain = start_chain if seed_pos == start_seed else 0
+            for chain_pos in range(first_chain, len(transmission_chains)):
+                (orig_cwgt, chain_wgt, chain) = transmission_chains[chain_pos]
                 genome_wgt = seed_wgt * chain_wgt
                 genome = self._generate_single_chain(seed_status, chain)
                 if genome is not None:
                     genomes += [(genome_wgt, genome_wgt, genome)]
+                self._save_checkpoint(seed_pos, chain_pos, len(transmission_chains), {}, genomes)
 
+        self._clear_checkpoint()
         logger.info('Simulation complete - {} valid genome sets returned'.format(
             len(genomes)))
 
         return genomes
 
+    def _create_truncated_genome_sets(self, gene_frequency, transmission_chains, tolerance):
+
+        ''' Create probability weighted sets of genomes, most likely initial genomes first
+
+        Each unexplored initial genome could add at most its prior weight times the total
+        chain weight to any probability's numerator and denominator. Stops once that
+        unexplored weight bounds the error of every probability below tolerance '''
+
+        founders = self._founder_permutations()
+        allele_weights = self._allele_weights(gene_frequency)
+        chain_weight = sum([chain_wgt for (orig_cwgt, chain_wgt, chain) in transmission_chains])
+        remaining = founders.total_weight(allele_weights)
+        key_people = self.__independent_genomes
+
+        ((start_seed, start_chain), state, genomes) = self._load_checkpoint()
+        if state is None:
+            total_wgt = 0.
+        else:
+            (total_wgt, remaining) = (state['total_wgt'], state['remaining'])
+        explored = start_seed
+        logger.info('Starting truncated simulation - at most {} potential genome sets to create'.format(
+            len(founders) * len(transmission_chains)))
+        for (seed_pos, (orig_swgt, seed_wgt, seed_chain)) in enumerate(founders.by_weight(allele_weights)):
+            if seed_pos < start_seed:
+                continue
+            # A seed resumed part way through already passed this check
+            first_chain = start_chain if seed_pos == start_seed else 0
+            unexplored_wgt = max(remaining, 0.) * chain_weight
+            if first_chain == 0 and total_wgt > 0 and \
+                    unexplored_wgt / (total_wgt + unexplored_wgt) <= tolerance:
+                break
+            seed_status = dict(zip(key_people, seed_chain))
+            for chain_pos in range(first_chain, len(transmission_chains)):
+                (orig_cwgt, chain_wgt, chain) = transmission_chains[chain_pos]
+                genome_wgt = seed_wgt * chain_wgt
+                genome = self._generate_single_chain(seed_status, chain)
+                if genome is not None:
+                    genomes += [(genome_wgt, genome_wgt, genome)]
+                    total_wgt += genome_wgt
+                if chain_pos == len(transmission_chains) - 1:
+                    remaining -= seed_wgt
+                    explored += 1
+                self._save_checkpoint(seed_pos, chain_pos, len(transmission_chains),
+                                      {'total_wgt': total_wgt, 'remaining': remaining}, genomes)
+        else:
+            remaining = 0.
+
+        self._clear_checkpoint()
+
+        self._unexplored_weight = max(remaining, 0.) * chain_weight
+        error_bound = 0. if self._unexplored_weight == 0 else \
+            self._unexplored_weight / (total_wgt + self._unexplored_weight)
+        logger.info('Simulation truncated after {} of {} initial genomes - {} valid genome sets returned; '
+                    'error bound {}'.format(explored, len(founders), len(genomes), error_bound))
+
+        return genomes
+
+    def _load_checkpoint(self):
+
+        ''' Get the (seed, chain) position, state and genome sets to resume from, if checkpointing '''
+        return self._resume
+
+    def _save_checkpoint(self, seed_pos, chain_pos, n_chains, state, genomes):
+
+        ''' Save the position after the current (seed, chain) pair if a checkpoint is due '''
+        if self._checkpoint is None or not self._checkpoint.due():
+            return None
+        if chain_pos + 1 == n_chains:
+            (seed_pos, chain_pos) = (seed_pos + 1, -1)
+        self._checkpoint.save((seed_pos, chain_pos + 1), state, genomes)
+
+    def _clear_checkpoint(self):
+
+        if self._checkpoint is not None:
+            self._checkpoint.clear()
+
     def _generate_single_chain(self, input_statuses:dict, transmission_chain:list):
 
         ''' Generate a full set of genetic material given input genetics and a transmission list
@@ -205,7 +300,7 @@ class SimulatePrevalence:
         # Return an ordered list of genetic statuses
         return [status[name] for name in self.__family_list]
 
-    def simulate(self, recessive_prevalence=None):
+    def simulate(self, recessive_prevalence=None, tolerance=None):
 
         #logger.info('Starting simulation')
         print('Starting simulation')
@@ -215,16 +310,166 @@ class SimulatePrevalence:
             recessive_prevalence = self._recessive_prevalence
         assert(recessive_prevalence is not None)
         gene_frequency = recessive_prevalence ** 0.5
-        initial_genomes = self._get_possible_initial_genomes(gene_frequency)
+        if tolerance is None:
+            tolerance = self._tolerance
+
+        # Identify this run from its requested inputs so an interrupted simulation can resume
+        self._checkpoint = None
+        self._resume = ((0, 0), None, [])
+        if self._checkpoint_path is not None:
+            fingerprint = Checkpoint.make_fingerprint(
+                family_list=self.__family_list, relationships=self.__relationships,
+                status_dict=self._status_dict,
+                recessive_list=None if self.__recessive_list is None else sorted(self.__recessive_list),
+                recessives_are_known=self._recessives_are_known,
+                recessive_prevalence=recessive_prevalence, tolerance=tolerance,
+                max_seconds=self._max_seconds, max_memory=self._max_memory,
+                max_tolerance=self._max_tolerance)
+            self._checkpoint = Checkpoint(self._checkpoint_path, fingerprint, self._checkpoint_interval)
+            self._resume = self._checkpoint.load()
+
+        # Reuse the strategy of a resumed run; run exactly if nothing asks for planning;
+        # otherwise choose a strategy within budget
+        if self._checkpoint is not None and self._checkpoint.settings is not None:
+            (strategy, tolerance) = (self._checkpoint.settings['strategy'], self._checkpoint.settings['tolerance'])
+            logger.info('Resuming {} simulation chosen before the checkpoint'.format(strategy))
+        else:
+            if (tolerance, self._max_seconds, self._max_memory, self._max_tolerance) == (None,) * 4:
+                strategy = 'exact'
+            else:
+                plan = self.plan_simulation(recessive_prevalence, tolerance)
+                (strategy, tolerance) = (plan.strategy, plan.run_tolerance)
+            if self._checkpoint is not None:
+                self._checkpoint.settings = {'strategy': strategy, 'tolerance': tolerance}
 
         # Get potential transmission trees
         transmission_chains = self._get_transmission_chains(self.__relationships)
 
-        # Simulate genomes
-        self._simulation = self._create_genome_sets(initial_genomes, transmission_chains)
+        # Simulate genomes, exhaustively unless truncation was chosen
+        if tolerance is None:
+            initial_genomes = self._get_possible_initial_genomes(gene_frequency)
+            self._simulation = self._create_genome_sets(initial_genomes, transmission_chains)
+            self._unexplored_weight = 0.
+        else:
+            self._simulation = self._create_truncated_genome_sets(
+                gene_frequency, transmission_chains, tolerance)
 
         return self._simulation
 
+    def plan_simulation(self, recessive_prevalence=None, tolerance=None):
+
+        ''' Estimate the time and memory of each strategy and choose one within budget
+
+        Times a sample of (initial genome, chain) pairs. For truncated runs, samples a few
+        chains for each initial genome in the order they would be explored to estimate how
+        the error bound falls as more are explored '''
+
+        if recessive_prevalence is None:
+            recessive_prevalence = self._recessive_prevalence
+        assert(recessive_prevalence is not None)
+        gene_frequency = recessive_prevalence ** 0.5
+        if tolerance is None:
+            tolerance = self._tolerance
+
+        key_people = self.__independent_genomes
+        founders = self._founder_permutations()
+        chains = WeightedPermutations(len(self.__relationships), 1)
+        (n_founders, n_chains) = (len(founders), len(chains))
+        chain_weight = chains.total_weight([1., 1.])
+        rng = random.Random(0)
+        timing = [0., 0]
+
+        def sample(seed_chain):
+            chain = [rng.randint(0, 1) for relationship in self.__relationships]
+            start = time.perf_counter()
+            genome = self._generate_single_chain(dict(zip(key_people, seed_chain)), chain)
+            timing[0] += time.perf_counter() - start
+            timing[1] += 1
+            return genome is not None
+
+        # Share of all pairs which are valid, from a uniform sample
+        n_samples = min(_PLAN_SAMPLES, n_founders * n_chains)
+        valid_share = sum([sample([rng.choice(values) for values in founders.allowed])
+                           for i in range(n_samples)]) / max(n_samples, 1)
+
+        # Approximate bytes held per initial genome, chain and valid genome set
+        founder_bytes = sys.getsizeof((1., 1., {})) + sys.getsizeof(dict.fromkeys(key_people)) + 24
+        chain_bytes = sys.getsizeof((1., 1., [])) + sys.getsizeof([0] * len(self.__relationships)) + 24
+        genome_bytes = sys.getsizeof((1., 1., [])) + sys.getsizeof([0] * len(self.__family_list)) + 24
+
+        def estimate(strategy, error, n_initial, valid_genome_sets, initial_bytes):
+            return {'strategy': strategy, 'tolerance': error,
+                    'genome_sets': n_initial * n_chains, 'valid_genome_sets': valid_genome_sets,
+                    'seconds': n_initial * n_chains * timing[0] / max(timing[1], 1),
+                    'memory': initial_bytes + n_chains * chain_bytes + valid_genome_sets * genome_bytes}
+
+        # Follow the truncated exploration order while it could still be useful
+        (trajectory, sample_limit) = ([], None)
+        if n_founders > 0 and (tolerance is not None or self._max_tolerance is not None):
+            allele_weights = self._allele_weights(gene_frequency)
+            remaining = founders.total_weight(allele_weights)
+            (total_wgt, valid_genome_sets) = (0., 0.)
+            n_per_founder = min(n_chains, max(2, _PLAN_TRUNCATED_SAMPLES // min(n_founders, _PLAN_INITIAL_GENOMES)))
+            explored = enumerate(islice(founders.by_weight(allele_weights), _PLAN_INITIAL_GENOMES), 1)
+            for (n_initial, (orig_swgt, seed_wgt, seed_chain)) in explored:
+                valid = sum([sample(seed_chain) for i in range(n_per_founder)]) / n_per_founder
+                total_wgt += seed_wgt * chain_weight * valid
+                valid_genome_sets += n_chains * valid
+                remaining = 0. if n_initial == n_founders else remaining - seed_wgt
+                unexplored_wgt = max(remaining, 0.) * chain_weight
+                error = 1. if total_wgt == 0 else unexplored_wgt / (total_wgt + unexplored_wgt)
+                trajectory += [(error, n_initial, valid_genome_sets)]
+                if error <= (0. if tolerance is None else tolerance):
+                    break
+                if self._max_seconds is not None and \
+                        n_initial * n_chains * timing[0] / timing[1] > self._max_seconds:
+                    break
+            else:
+                if len(trajectory) < n_founders:
+                    sample_limit = _PLAN_INITIAL_GENOMES
+
+        exact = estimate('exact', 0., n_founders, n_founders * n_chains * valid_share,
+                         n_founders * founder_bytes)
+        truncated = [estimate('truncated', error, n_initial, valid_genome_sets, 0.)
+                     for (error, n_initial, valid_genome_sets) in trajectory]
+        logger.info('Planning: {} initial genomes x {} transmission chains'.format(n_founders, n_chains))
+
+        self._plan = SimulationPlan(exact, truncated, tolerance,
+                                    self._max_seconds, self._max_memory, self._max_tolerance,
+                                    sample_limit)
+        logger.info('Planned strategy: {}'.format(self._plan.strategy))
+
+        return self._plan
+
+    def explain(self):
+
+        ''' Describe the estimated costs and the strategy chosen for the last plan '''
+        if self._plan is None:
+            self.plan_simulation()
+
+        return self._plan.explain()
+
+    @property
+    def error_bound(self):
+
+        ''' Upper bound on the absolute error of any probability from the last simulation '''
+        if self._unexplored_weight == 0:
+            return 0.
+        total_wgt = sum([new for (old, new, chain) in self._simulation])
+
+        return self._unexplored_weight / (total_wgt + self._unexplored_weight)
+
+    def error_bounds(self, statuses=[0,1,2]):
+
+        ''' Upper bound on the absolute error of each probability in individual_probabilities
+
+        The unexplored weight can pull a probability p towards 0 or 1, so its
+        error is at most max(p, 1-p) times the overall error bound '''
+        probabilities = self.individual_probabilities(statuses)
+        bound = self.error_bound
+
+        return probabilities.astype(float).apply(lambda p: p.where(p > 0.5, 1 - p) * bound)
+
     def individual_probabilities(self, statuses=[0,1,2], genomes=None):
 
         if genomes is None:
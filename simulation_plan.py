@@ -0,0 +1,124 @@
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+class BudgetExceededError(RuntimeError):
+
+    "Raised when no simulation strategy fits within the configured budget"
+
+
+class SimulationPlan:
+
+    "Estimated cost of each simulation strategy, and the cheapest one meeting the accuracy and budget"
+
+    def __init__(self, exact:dict, truncated:list, tolerance:float=None,
+                 max_seconds:float=None, max_memory:float=None, max_tolerance:float=None,
+                 sample_limit:int=None):
+
+        ''' Choose a strategy from cost estimates
+
+        exact is the estimate for a full enumeration. truncated lists estimates for a
+        truncated simulation stopped after successively more initial genomes, so their
+        tolerance falls as their cost rises. Each estimate is a dict with strategy,
+        tolerance, genome_sets, valid_genome_sets, seconds and memory (bytes).
+        sample_limit is the number of initial genomes sampled if sampling stopped
+        before the truncated estimates were complete '''
+        self.exact = exact
+        self.truncated = truncated
+        self.tolerance = tolerance
+        self.max_seconds = max_seconds
+        self.max_memory = max_memory
+        self.max_tolerance = max_tolerance
+        self.sample_limit = sample_limit
+        self.downgraded = False
+        self.choice = None
+        self.choice = self._choose()
+
+    @property
+    def strategy(self):
+        return self.choice['strategy']
+
+    @property
+    def run_tolerance(self):
+
+        ''' Tolerance to run the chosen strategy with; None for an exact run '''
+        if self.strategy == 'exact':
+            return None
+        elif self.downgraded:
+            return self.choice['tolerance']
+        else:
+            return self.tolerance
+
+    def _within_budget(self, estimate):
+
+        return (self.max_seconds is None or estimate['seconds'] <= self.max_seconds) and \
+               (self.max_memory is None or estimate['memory'] <= self.max_memory)
+
+    def _choose(self):
+
+        ''' Pick the cheapest strategy meeting the tolerance, downgrading if over budget '''
+
+        # Exact always meets the tolerance; truncated needs the first estimate reaching it
+        candidates = [self.exact]
+        if self.tolerance is not None:
+            candidates += [estimate for estimate in self.truncated
+                           if estimate['tolerance'] <= self.tolerance][:1]
+        if self.tolerance is not None and len(candidates) == 1 and self.sample_limit is not None:
+            logger.warning(self._unevaluated_note())
+        choice = min(candidates, key=lambda estimate: estimate['seconds'])
+        if self._within_budget(choice):
+            return choice
+
+        # Otherwise accept the most accurate truncated run which fits the budget
+        if self.max_tolerance is not None:
+            affordable = [estimate for estimate in self.truncated
+                          if self._within_budget(estimate) and estimate['tolerance'] <= self.max_tolerance]
+            if len(affordable) > 0:
+                self.downgraded = True
+                logger.warning('Simulation over budget - downgraded to tolerance {:.3g}'.format(
+                    affordable[-1]['tolerance']))
+                return affordable[-1]
+
+        raise BudgetExceededError('No simulation strategy fits the budget\n' + self.explain())
+
+    def _unevaluated_note(self):
+
+        return 'Truncated cost at tolerance {} not evaluated - sampling stopped after {} initial ' \
+               'genomes at estimated tolerance {:.3g}'.format(
+                   self.tolerance, self.sample_limit, self.truncated[-1]['tolerance'])
+
+    def explain(self):
+
+        ''' Describe the estimated cost of each strategy and the choice made '''
+
+        def describe(estimate):
+            return '{:<10} tolerance {:<9.3g} {:>10.3g} genome sets ({:.3g} valid), ' \
+                   '~{:.3g} s, ~{:.3g} MB'.format(
+                       estimate['strategy'], estimate['tolerance'], estimate['genome_sets'],
+                       estimate['valid_genome_sets'], estimate['seconds'], estimate['memory'] / 1e6)
+
+        lines = ['Requested tolerance: {}'.format('exact' if self.tolerance is None else self.tolerance),
+                 'Budget: {} s, {} MB'.format(
+                     'unlimited' if self.max_seconds is None else self.max_seconds,
+                     'unlimited' if self.max_memory is None else self.max_memory / 1e6),
+                 'Estimates:', '  ' + describe(self.exact)]
+
+        # Truncated estimates at the requested tolerance and the furthest one sampled
+        shown = [estimate for estimate in self.truncated
+                 if self.tolerance is not None and estimate['tolerance'] <= self.tolerance][:1]
+        if len(self.truncated) > 0 and self.truncated[-1] not in shown:
+            shown += [self.truncated[-1]]
+        if self.choice is not None and self.choice['strategy'] == 'truncated' and self.choice not in shown:
+            shown = [self.choice] + shown
+        lines += ['  ' + describe(estimate) for estimate in shown]
+        if self.tolerance is not None and self.sample_limit is not None and \
+                not any(estimate['tolerance'] <= self.tolerance for estimate in self.truncated):
+            lines += ['Note: ' + self._unevaluated_note()]
+
+        if self.choice is None:
+            lines += ['Chosen: none within budget']
+        else:
+            lines += ['Chosen: ' + describe(self.choice) + (' (downgraded to fit budget)' if self.downgraded else '')]
+
+        return '\n'.join(lines)
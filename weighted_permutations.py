@@ -1,35 +1,128 @@
 import math
+import heapq
+import itertools
+import numpy as np
 
 class WeightedPermutations:
 
     "Get all lists of genetic permutations for n people with k genes"
 
-    def __init__(self, n:int, k:int):
+    def __init__(self, n:int, k:int, allowed:list=None):
 
-        self.permutations = []
-        base_array = (1., 1., [None]*n)
+        ''' Store the permutation space; permutations are generated lazily
 
-        self.__generateWeightedStrings(n, base_array, 0, k)
+        allowed optionally gives, for each of the n positions, the set of values
+        that position may take. Positions set to None may take any value 0..k '''
+
+        if allowed is None:
+            allowed = [None] * n
+        assert(len(allowed) == n)
+
+        self.n = n
+        self.k = k
+        self.allowed = [sorted(set(range(k+1)) if values is None else set(values))
+                        for values in allowed]
+        for values in self.allowed:
+            assert(all(value in range(k+1) for value in values))
+
+    @property
+    def permutations(self):
+        return list(self)
 
     @staticmethod
-    def run(n, k=1):
+    def run(n, k=1, allowed=None):
 
-        temp = WeightedPermutations(n, k)
+        temp = WeightedPermutations(n, k, allowed)
 
         return temp.permutations
 
-    def __generateWeightedStrings(self, n, arr, i, k):
+    @staticmethod
+    def iterate(n, k=1, allowed=None):
+
+        return iter(WeightedPermutations(n, k, allowed))
+
+    @staticmethod
+    def run_array(n, k=1, allowed=None):
+
+        temp = WeightedPermutations(n, k, allowed)
+
+        return temp.to_array()
+
+    def __len__(self):
+
+        return math.prod(len(values) for values in self.allowed)
+
+    def __iter__(self):
+
+        ''' Yield (weight, weight, [values]) for every valid permutation
+
+        Position 0 is the most significant, matching the original recursive ordering '''
+
+        # Pair each allowed value with its binomial weight once, rather than per node
+        options = [[(j, math.comb(self.k, j)) for j in values] for values in self.allowed]
+
+        for combination in itertools.product(*options):
+            weight = 1.
+            for (j, comb) in combination:
+                weight *= comb
+            yield (weight, weight, [j for (j, comb) in combination])
+
+    def to_array(self):
+
+        ''' Return all valid permutations in bulk as NumPy arrays
+
+        Returns: a tuple with (weights, values), of shapes (m,) and (m, n) '''
+
+        shape = tuple(len(values) for values in self.allowed)
+        if self.n == 0:
+            return np.ones(1), np.zeros((1, 0), dtype=np.int8)
+
+        # Row-major index grid keeps position 0 as the most significant
+        index = np.indices(shape).reshape(self.n, -1)
+        values = np.empty((index.shape[1], self.n), dtype=np.int8)
+        weights = np.ones(index.shape[1])
+        for pos in range(self.n):
+            allowed = np.array(self.allowed[pos], dtype=np.int8)
+            combs = np.array([math.comb(self.k, j) for j in self.allowed[pos]], dtype=float)
+            values[:, pos] = allowed[index[pos]]
+            weights *= combs[index[pos]]
+
+        return weights, values
+
+    def by_weight(self, value_weights:list):
+
+        ''' Yield (weight, weight, [values]) in decreasing order of weight
+
+        Each value j at a position is weighted by comb(k, j) * value_weights[j].
+        Best-first search: a permutation's children increment one position at or
+        after its last incremented position, so each is reached exactly once '''
+
+        # Sort each position's options by decreasing weight
+        options = [sorted(((math.comb(self.k, j) * value_weights[j], j) for j in values),
+                          reverse=True)
+                   for values in self.allowed]
+        if any(len(values) == 0 for values in options):
+            return
+
+        def weight_of(index):
+            weight = 1.
+            for pos in range(self.n):
+                weight *= options[pos][index[pos]][0]
+            return weight
+
+        start = (0,) * self.n
+        heap = [(-weight_of(start), start, 0)]
+        while heap:
+            (weight, index, last) = heapq.heappop(heap)
+            yield (-weight, -weight, [options[pos][index[pos]][1] for pos in range(self.n)])
+            for pos in range(last, self.n):
+                if index[pos] + 1 < len(options[pos]):
+                    child = index[:pos] + (index[pos] + 1,) + index[pos+1:]
+                    heapq.heappush(heap, (-weight_of(child), child, pos))
 
-        if i==n:
-            self.permutations += [arr]
-            return None
+    def total_weight(self, value_weights:list):
 
-        # Get all arrays with j in the i-th position
-        # Position 0 is incremented by weight
-        for j in range(k+1):
-            temp_arr = arr[2].copy()
-            temp_arr[i] = j
-            new_weight = arr[0] * math.comb(k, j)
-            self.__generateWeightedStrings(n, (new_weight, new_weight, temp_arr), i+1, k)
+        ''' Sum of by_weight weights over every valid permutation '''
 
-        return 'Complete'
\ No newline at end of file
+        return math.prod(sum(math.comb(self.k, j) * value_weights[j] for j in values)
+                         for values in self.allowed)